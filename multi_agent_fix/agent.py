@@ -2,9 +2,86 @@
 
 import os
 import json
+import atexit
+import random
+import asyncio
+import hashlib
 import httpx
 from dataclasses import dataclass
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:  # optional Rust JSON codec; worth 3-5x on large payloads
+    import orjson
+except ImportError:
+    orjson = None
+
+from . import llm_cache
+
+# Shared async client: one connection pool (HTTP/2 when the provider supports
+# it) multiplexes all agent requests instead of paying a TLS handshake per
+# agent. Agent rounds all run on one persistent event loop (_run_async), so
+# the pool survives across rounds instead of being orphaned per asyncio.run.
+_CLIENT: httpx.AsyncClient | None = None
+_CLIENT_LOOP: asyncio.AbstractEventLoop | None = None
+
+_LOOP: asyncio.AbstractEventLoop | None = None
+
+
+def _run_async(coro):
+    """Run a coroutine on the module's persistent event loop."""
+    global _LOOP
+    if _LOOP is None or _LOOP.is_closed():
+        _LOOP = asyncio.new_event_loop()
+    return _LOOP.run_until_complete(coro)
+
+
+def _shutdown() -> None:
+    if _LOOP is not None and not _LOOP.is_closed():
+        if _CLIENT is not None and _CLIENT_LOOP is _LOOP:
+            _LOOP.run_until_complete(_CLIENT.aclose())
+        _LOOP.close()
+
+
+atexit.register(_shutdown)
+
+# Read timeouts calibrated per provider (roughly p95 of a fix-sized
+# completion); a stuck request is retried instead of stalling the whole
+# agent round for the old blanket 120s.
+_PROVIDER_TIMEOUT = {"openai": 30, "anthropic": 45, "gemini": 20, "openrouter": 45}
+_PROVIDER_RETRIES = 2
+_RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# After the first viable fix arrives, how long to keep collecting extras
+# from the remaining agents before cancelling them.
+_GRACE_SECONDS = 1.5
+
+# Max failing tests folded into a single batched prompt.
+_MAX_BATCH = 8
+
+
+async def _close_client(client: httpx.AsyncClient) -> None:
+    """Best-effort close for a client whose pool we are abandoning."""
+    try:
+        await client.aclose()
+    except Exception:
+        pass
+
+
+def _get_client() -> httpx.AsyncClient:
+    """Return the shared AsyncClient for the running event loop."""
+    global _CLIENT, _CLIENT_LOOP
+    loop = asyncio.get_running_loop()
+    if _CLIENT is None or _CLIENT_LOOP is not loop:
+        if _CLIENT is not None:
+            # Someone drove us from a foreign loop; don't leak the old
+            # pool's sockets while we rebuild
+            loop.create_task(_close_client(_CLIENT))
+        _CLIENT = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(120.0),
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+        )
+        _CLIENT_LOOP = loop
+    return _CLIENT
 
 
 @dataclass
@@ -16,6 +93,54 @@ class FixAttempt:
     new_content: str
     explanation: str
     success: bool = False
+    temperature: float = 0.0
+
+
+def _cache_eligible(temperature: float) -> bool:
+    """Whether a call may be served from cache instead of the provider.
+
+    Deterministic calls (temperature 0) are safe to replay; MAF_CACHE_ALL=1
+    opts higher temperatures in for cheap re-runs. Everything else must
+    reach the provider so repeated prompts draw fresh samples.
+    """
+    return temperature == 0.0 or os.environ.get("MAF_CACHE_ALL") == "1"
+
+
+# Parsed fixes memoized per request hash, so a response cache hit also skips
+# the JSON re-parse. In-memory only; the raw text lives in llm_cache, and
+# entries follow the same eligibility rule as the response cache.
+_PARSED_CACHE: dict[str, tuple[str, str, str]] = {}
+
+_JSON_DECODER = json.JSONDecoder(strict=False)
+
+
+def _extract_json_object(s: str) -> dict | None:
+    """Parse the first balanced JSON object in ``s``, or None.
+
+    raw_decode scans exactly to the end of the object in one pass, so prose
+    or markdown fences after the JSON need no rfind guessing, and a stray
+    brace inside the "content" string no longer truncates the object.
+    """
+    start = s.find("{")
+    if start < 0:
+        return None
+    try:
+        obj, _ = _JSON_DECODER.raw_decode(s, start)
+    except json.JSONDecodeError:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+
+def _extract_json_array(s: str) -> list | None:
+    """Parse the first balanced JSON array in ``s``, or None."""
+    start = s.find("[")
+    if start < 0:
+        return None
+    try:
+        arr, _ = _JSON_DECODER.raw_decode(s, start)
+    except json.JSONDecodeError:
+        return None
+    return arr if isinstance(arr, list) else None
 
 
 def get_api_config() -> tuple[str, str, str]:
@@ -52,14 +177,27 @@ def get_api_config() -> tuple[str, str, str]:
     )
 
 
-def call_llm(
+async def call_llm(
     provider: str,
     api_key: str,
     model: str,
     prompt: str,
     temperature: float = 0.7,
+    prompt_cache_key: str | None = None,
 ) -> str:
-    """Call LLM API and return response."""
+    """Call LLM API and return response.
+
+    ``prompt_cache_key`` opts the request into provider-side prefix caching:
+    all N agents in a round share the same prompt, so N-1 of them can reuse
+    the provider's cached prefill for faster TTFT and cheaper input tokens.
+    """
+    cache_key = None
+    if _cache_eligible(temperature):
+        cache_key = llm_cache.request_key(provider, model, temperature, prompt)
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
     headers = {}
     url = ""
     payload = {}
@@ -72,6 +210,8 @@ def call_llm(
             "messages": [{"role": "user", "content": prompt}],
             "temperature": temperature,
         }
+        if prompt_cache_key is not None:
+            payload["prompt_cache_key"] = prompt_cache_key
 
     elif provider == "anthropic":
         url = "https://api.anthropic.com/v1/messages"
@@ -79,10 +219,20 @@ def call_llm(
             "x-api-key": api_key,
             "anthropic-version": "2023-06-01",
         }
+        if prompt_cache_key is not None:
+            content = [
+                {
+                    "type": "text",
+                    "text": prompt,
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ]
+        else:
+            content = prompt
         payload = {
             "model": model,
             "max_tokens": 4096,
-            "messages": [{"role": "user", "content": prompt}],
+            "messages": [{"role": "user", "content": content}],
             "temperature": temperature,
         }
 
@@ -105,32 +255,55 @@ def call_llm(
     else:
         raise ValueError(f"Unknown provider: {provider}")
 
-    with httpx.Client(timeout=120) as client:
-        response = client.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
+    client = _get_client()
+    timeout = httpx.Timeout(
+        _PROVIDER_TIMEOUT.get(provider, 45), connect=5.0
+    )
+    # Serialize the payload once, outside the retry loop; test_source and
+    # test_output make these bodies tens of KB
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = json.dumps(payload).encode()
+    headers["content-type"] = "application/json"
+
+    last_exc: Exception = ValueError("no attempt made")
+    for attempt in range(_PROVIDER_RETRIES + 1):
+        try:
+            response = await client.post(
+                url, headers=headers, content=body, timeout=timeout
+            )
+            response.raise_for_status()
+            data = response.json()
+            break
+        except httpx.TimeoutException as e:
+            last_exc = e
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code not in _RETRYABLE_STATUS:
+                raise
+            last_exc = e
+        # Exponential backoff with jitter, but only when a retry follows
+        if attempt < _PROVIDER_RETRIES:
+            await asyncio.sleep(0.5 * 2**attempt + random.random() * 0.25)
+    else:
+        raise last_exc
 
     # Extract text based on provider
     if provider == "anthropic":
-        return data["content"][0]["text"]
+        text = data["content"][0]["text"]
     elif provider == "gemini":
-        return data["candidates"][0]["content"]["parts"][0]["text"]
+        text = data["candidates"][0]["content"]["parts"][0]["text"]
     else:  # openai, openrouter
-        return data["choices"][0]["message"]["content"]
+        text = data["choices"][0]["message"]["content"]
 
+    if cache_key is not None:
+        llm_cache.set(cache_key, text)
+    return text
 
-def generate_fix(
-    agent_id: int,
-    test_name: str,
-    test_file: str,
-    test_source: str,
-    test_output: str,
-    temperature: float,
-) -> FixAttempt:
-    """Generate a fix for a failing test."""
-    provider, api_key, model = get_api_config()
 
-    prompt = f"""You are a debugging expert. A test is failing. Fix the code.
+# Static prompt scaffolding, interpolated once per test/attempt rather than
+# re-built inside every agent coroutine
+_PROMPT_TEMPLATE = """You are a debugging expert. A test is failing. Fix the code.
 
 ## Failed Test
 Name: {test_name}
@@ -161,26 +334,96 @@ File: {test_file}
 
 Return ONLY the JSON, no other text."""
 
+
+def build_prompt(
+    test_name: str,
+    test_file: str,
+    test_source: str,
+    test_output: str,
+    feedback: str = "",
+) -> str:
+    """Render the fix prompt; all agents in a round share the result.
+
+    ``feedback`` describes an earlier failed attempt so retries don't
+    regenerate the same wrong fix.
+    """
+    prompt = _PROMPT_TEMPLATE.format_map(
+        {
+            "test_name": test_name,
+            "test_file": test_file,
+            "test_source": test_source,
+            "test_output": test_output,
+        }
+    )
+    if feedback:
+        prompt += f"\n\n## Previous Attempt\n{feedback}"
+    return prompt
+
+
+def _prompt_cache_key(prompt: str) -> str:
+    """Stable per-prompt key; same prompt means a provider-side cache hit."""
+    return hashlib.blake2b(prompt.encode(), digest_size=16).hexdigest()
+
+
+async def generate_fix(
+    agent_id: int,
+    test_file: str,
+    prompt: str,
+    temperature: float,
+    enable_prefix_cache: bool = True,
+) -> FixAttempt:
+    """Generate a fix for a failing test from a pre-built prompt."""
+    provider, api_key, model = get_api_config()
+
+    cacheable = _cache_eligible(temperature)
+    request_hash = None
+    if cacheable:
+        request_hash = llm_cache.request_key(provider, model, temperature, prompt)
+        parsed = _PARSED_CACHE.get(request_hash)
+        if parsed is not None:
+            file, content, explanation = parsed
+            return FixAttempt(
+                agent_id=agent_id,
+                file=file,
+                new_content=content,
+                explanation=explanation,
+                temperature=temperature,
+            )
+
     try:
-        response = call_llm(provider, api_key, model, prompt, temperature)
+        response = await call_llm(
+            provider,
+            api_key,
+            model,
+            prompt,
+            temperature,
+            prompt_cache_key=_prompt_cache_key(prompt) if enable_prefix_cache else None,
+        )
 
         # Parse JSON from response
-        json_start = response.find("{")
-        json_end = response.rfind("}") + 1
-        if json_start >= 0 and json_end > json_start:
-            data = json.loads(response[json_start:json_end])
-            return FixAttempt(
+        data = _extract_json_object(response)
+        if data is not None:
+            fix = FixAttempt(
                 agent_id=agent_id,
                 file=data.get("file", test_file),
                 new_content=data.get("content", ""),
                 explanation=data.get("explanation", ""),
+                temperature=temperature,
             )
+            if cacheable:
+                _PARSED_CACHE[request_hash] = (
+                    fix.file,
+                    fix.new_content,
+                    fix.explanation,
+                )
+            return fix
     except Exception as e:
         return FixAttempt(
             agent_id=agent_id,
             file=test_file,
             new_content="",
             explanation=f"Error: {e}",
+            temperature=temperature,
         )
 
     return FixAttempt(
@@ -188,41 +431,245 @@ Return ONLY the JSON, no other text."""
         file=test_file,
         new_content="",
         explanation="Failed to parse response",
+        temperature=temperature,
     )
 
 
+# Temperature spread for a full parallel round, and the escalation rungs
+# fired only after a temperature-0 attempt failed
+_TEMPERATURE_LADDER = [0.3, 0.5, 0.7, 0.9, 1.0]
+_ESCALATION_TEMPERATURES = [0.5, 0.7, 0.9, 1.0]
+
+
+async def _gather_fixes(
+    test_name: str,
+    test_file: str,
+    test_source: str,
+    test_output: str,
+    temperatures: list[float],
+    first_agent_id: int = 0,
+    enable_prefix_cache: bool = True,
+    feedback: str = "",
+) -> list[FixAttempt]:
+    """Await one agent per temperature and collect non-empty fixes."""
+    prompt = build_prompt(test_name, test_file, test_source, test_output, feedback)
+    pending = {
+        asyncio.ensure_future(
+            generate_fix(
+                first_agent_id + i,
+                test_file,
+                prompt,
+                temperature,
+                enable_prefix_cache,
+            )
+        )
+        for i, temperature in enumerate(temperatures)
+    }
+
+    def collect(done: set[asyncio.Task], fixes: list[FixAttempt]) -> None:
+        for task in done:
+            try:
+                fix = task.result()
+            except Exception:
+                continue
+            if fix.new_content:
+                fixes.append(fix)
+
+    # Race semantics: the first viable fix starts the (slow) test-verify
+    # phase, so once we have one we give the stragglers a short grace window
+    # for diversity and then cancel them instead of paying max-over-N latency
+    # and tokens.
+    fixes: list[FixAttempt] = []
+    try:
+        while pending and not fixes:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            collect(done, fixes)
+        if pending and fixes:
+            done, pending = await asyncio.wait(pending, timeout=_GRACE_SECONDS)
+            collect(done, fixes)
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    return fixes
+
+
 def run_parallel_agents(
     test_name: str,
     test_file: str,
     test_source: str,
     test_output: str,
     num_agents: int = 3,
+    enable_prefix_cache: bool = True,
 ) -> list[FixAttempt]:
     """Run multiple agents in parallel to generate fixes."""
-    # Use different temperatures for diversity
-    temperatures = [0.3, 0.5, 0.7, 0.9, 1.0][:num_agents]
+    temperatures = [
+        _TEMPERATURE_LADDER[i % len(_TEMPERATURE_LADDER)] for i in range(num_agents)
+    ]
+    return _run_async(
+        _gather_fixes(
+            test_name,
+            test_file,
+            test_source,
+            test_output,
+            temperatures,
+            enable_prefix_cache=enable_prefix_cache,
+        )
+    )
+
 
-    fixes = []
-    with ThreadPoolExecutor(max_workers=num_agents) as executor:
-        futures = {
-            executor.submit(
-                generate_fix,
-                i,
+def iter_fix_batches(
+    test_name: str,
+    test_file: str,
+    test_source: str,
+    test_output: str,
+    num_agents: int = 3,
+    feedback: str = "",
+):
+    """Yield candidate fix batches with progressive temperature escalation.
+
+    The first batch is a single temperature-0 agent: deterministic,
+    cache-eligible, and often all that's needed. The remaining agents only
+    fire (at higher temperatures, racing as usual) when the caller comes
+    back for a second batch because no first-batch fix stuck.
+    """
+    yield _run_async(
+        _gather_fixes(
+            test_name, test_file, test_source, test_output, [0.0], feedback=feedback
+        )
+    )
+    if num_agents > 1:
+        escalation = [
+            _ESCALATION_TEMPERATURES[i % len(_ESCALATION_TEMPERATURES)]
+            for i in range(num_agents - 1)
+        ]
+        yield _run_async(
+            _gather_fixes(
                 test_name,
                 test_file,
                 test_source,
                 test_output,
-                temperatures[i % len(temperatures)],
-            ): i
-            for i in range(num_agents)
-        }
+                escalation,
+                first_agent_id=1,
+                feedback=feedback,
+            )
+        )
 
-        for future in as_completed(futures):
-            try:
-                fix = future.result()
-                if fix.new_content:
-                    fixes.append(fix)
-            except Exception:
-                pass
+
+async def generate_fixes_batched(
+    agent_id: int,
+    tests: list,
+    test_output: str,
+    temperature: float,
+) -> dict[str, FixAttempt]:
+    """Generate fixes for up to _MAX_BATCH failing tests in one LLM call.
+
+    ``tests`` is a list of runner.FailedTest; returns fixes keyed by test
+    name. One POST covers the whole batch instead of one per test.
+    """
+    provider, api_key, model = get_api_config()
+
+    sections = []
+    for i, test in enumerate(tests, 1):
+        sections.append(
+            f"### Test {i}\nName: {test.name}\nFile: {test.file}\n\n```\n{test.source}\n```"
+        )
+    tests_block = "\n\n".join(sections)
+
+    prompt = f"""You are a debugging expert. {len(tests)} test(s) are failing. Fix the code.
+
+## Failed Tests
+{tests_block}
+
+## Test Output
+```
+{test_output}
+```
+
+## Instructions
+1. Analyze why each test is failing
+2. Provide the COMPLETE fixed file content for each test
+3. Respond with a JSON array, one object per test, in this exact format:
+
+```json
+[
+  {{
+    "test": "TEST NAME HERE",
+    "file": "FILE PATH HERE",
+    "content": "COMPLETE FILE CONTENT HERE",
+    "explanation": "Brief explanation of the fix"
+  }}
+]
+```
+
+Return ONLY the JSON array, no other text."""
+
+    fixes: dict[str, FixAttempt] = {}
+    try:
+        response = await call_llm(
+            provider,
+            api_key,
+            model,
+            prompt,
+            temperature,
+            prompt_cache_key=_prompt_cache_key(prompt),
+        )
+
+        entries = _extract_json_array(response)
+        if entries is not None:
+            for entry, test in zip(entries, tests):
+                name = entry.get("test", test.name)
+                fixes[name] = FixAttempt(
+                    agent_id=agent_id,
+                    file=entry.get("file", test.file),
+                    new_content=entry.get("content", ""),
+                    explanation=entry.get("explanation", ""),
+                    temperature=temperature,
+                )
+    except Exception:
+        pass
 
     return fixes
+
+
+async def _gather_batched(
+    tests: list,
+    test_output: str,
+    num_agents: int,
+) -> dict[str, list[FixAttempt]]:
+    """Fan agents out over batched prompts and merge fixes per test."""
+    temperatures = [0.3, 0.5, 0.7, 0.9, 1.0][:num_agents]
+
+    tasks = []
+    for start in range(0, len(tests), _MAX_BATCH):
+        chunk = tests[start : start + _MAX_BATCH]
+        for i in range(num_agents):
+            tasks.append(
+                generate_fixes_batched(
+                    i, chunk, test_output, temperatures[i % len(temperatures)]
+                )
+            )
+
+    fixes_by_test: dict[str, list[FixAttempt]] = {test.name: [] for test in tests}
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for result in results:
+        if not isinstance(result, dict):
+            continue
+        for name, fix in result.items():
+            if fix.new_content:
+                fixes_by_test.setdefault(name, []).append(fix)
+
+    return fixes_by_test
+
+
+def run_parallel_agents_batched(
+    tests: list,
+    test_output: str,
+    num_agents: int = 3,
+) -> dict[str, list[FixAttempt]]:
+    """Run agents over all failing tests with batched prompts."""
+    return _run_async(_gather_batched(tests, test_output, num_agents))
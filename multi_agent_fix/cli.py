@@ -1,7 +1,11 @@
 """CLI interface for multi-agent-fix."""
 
 import sys
+import atexit
+import difflib
+import hashlib
 import click
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from rich.console import Console
 from rich.panel import Panel
@@ -14,11 +18,212 @@ from .runner import (
     get_test_context,
     apply_fix,
 )
-from .agent import run_parallel_agents
+from .agent import iter_fix_batches, run_parallel_agents_batched
 
 console = Console()
 err_console = Console(file=sys.stderr)
 
+# Persistent pool for context prefetching; created once per process instead
+# of per fix run, and torn down at exit.
+_PREFETCH_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="maf-prefetch")
+atexit.register(_PREFETCH_POOL.shutdown, wait=False)
+
+
+def _dedupe_fixes(fixes: list, seen: set[bytes] | None = None) -> list:
+    """Drop candidates with identical content; agents often converge.
+
+    Each duplicate skipped is one avoided test run. Low-temperature fixes
+    are tried first since they tend to be the mainstream ones. Passing a
+    shared ``seen`` set also drops content already tried by earlier batches.
+    """
+    if seen is None:
+        seen = set()
+    unique = []
+    for fix in sorted(fixes, key=lambda f: f.temperature):
+        digest = hashlib.blake2b(fix.new_content.encode(), digest_size=16).digest()
+        if digest not in seen:
+            seen.add(digest)
+            unique.append(fix)
+    return unique
+
+
+def _show_fix_preview(fix) -> None:
+    """Show a fix without applying it (dry-run mode)."""
+    table = Table(title=f"Agent {fix.agent_id}")
+    table.add_column("Field", style="cyan")
+    table.add_column("Value")
+    table.add_row("File", fix.file)
+    table.add_row("Explanation", fix.explanation)
+    console.print(table)
+    console.print("[dim]Content preview (first 500 chars):[/dim]")
+    console.print(fix.new_content[:500])
+    console.print()
+
+
+def _test_candidates(
+    project_path: Path,
+    framework: str,
+    test_name: str,
+    fixes: list,
+    dry_run: bool,
+    originals: dict[str, str] | None = None,
+    max_context_lines: int = 200,
+    applied_files: set[str] | None = None,
+) -> tuple[bool, str | None, object | None]:
+    """Apply candidate fixes one at a time until the test passes.
+
+    Returns (fixed, latest failure output, last failed fix); the latter two
+    let the caller prompt the next attempt with the current error instead of
+    stale context.
+
+    ``originals`` memoizes pre-fix file contents across attempts so each
+    touched file is read from disk once per test, and reverts always restore
+    the true original rather than a partially-fixed intermediate.
+    ``applied_files`` collects the files a winning fix left modified, so the
+    caller knows which prefetched contexts have gone stale.
+    """
+    if originals is None:
+        originals = {}
+
+    latest_output: str | None = None
+    last_failed_fix = None
+    for fix in fixes:
+        if dry_run:
+            _show_fix_preview(fix)
+            continue
+
+        # Resolve relative paths against the project exactly as apply_fix
+        # does, so the memoized original is the file the fix will touch
+        fix_path = Path(fix.file)
+        if not fix_path.is_absolute():
+            fix_path = project_path / fix.file
+        original_content = originals.setdefault(
+            fix.file, fix_path.read_text() if fix_path.exists() else ""
+        )
+
+        # Apply fix and test
+        if apply_fix(project_path, fix.file, fix.new_content):
+            with Progress(
+                SpinnerColumn(),
+                TextColumn("[progress.description]{task.description}"),
+                console=err_console,
+                transient=True,
+            ) as progress:
+                progress.add_task("Testing fix...", total=None)
+                # Only re-run the test we are trying to fix; the full
+                # suite runs once more at the end for final validation
+                new_result = run_tests(
+                    project_path, framework, max_context_lines, only=[test_name]
+                )
+
+            if new_result.passed or test_name not in new_result.failed_tests:
+                console.print(f"[green]Agent {fix.agent_id} fixed the test![/green]")
+                console.print(f"[dim]{fix.explanation}[/dim]")
+                if applied_files is not None:
+                    applied_files.add(fix.file)
+                return True, None, None
+
+            # Revert and try next fix
+            latest_output = new_result.output
+            last_failed_fix = fix
+            apply_fix(project_path, fix.file, original_content)
+
+    return False, latest_output, last_failed_fix
+
+
+def _fix_feedback(fix, original_content: str) -> str:
+    """Describe a failed fix as a short diff so retries don't repeat it."""
+    diff = list(
+        difflib.unified_diff(
+            original_content.splitlines(),
+            fix.new_content.splitlines(),
+            fromfile="original",
+            tofile="attempted_fix",
+            lineterm="",
+        )
+    )[:60]
+    if not diff:
+        return ""
+    diff_text = "\n".join(diff)
+    return (
+        "A previous attempt applied the change below and the test STILL "
+        f"failed. Do not repeat it.\n```diff\n{diff_text}\n```"
+    )
+
+
+def _fix_batched(
+    project_path: Path,
+    framework: str,
+    result,
+    agents: int,
+    dry_run: bool,
+    max_context_lines: int = 200,
+    full_context: bool = False,
+) -> int:
+    """Fix all failing tests with one batched agent round."""
+    contexts = [
+        get_test_context(project_path, test_name, framework, full_context)
+        for test_name in result.failed_tests
+    ]
+    for ctx in contexts:
+        if not ctx.source:
+            console.print(f"[yellow]Could not read test source for {ctx.name}[/yellow]")
+    readable = [ctx for ctx in contexts if ctx.source]
+    if not readable:
+        return 0
+
+    with Progress(
+        SpinnerColumn(),
+        TextColumn("[progress.description]{task.description}"),
+        console=err_console,
+        transient=True,
+    ) as progress:
+        progress.add_task(
+            f"Running {agents} agents on {len(readable)} test(s)...", total=None
+        )
+        fixes_by_test = run_parallel_agents_batched(readable, result.output, agents)
+
+    fixed_count = 0
+    applied_files: set[str] = set()
+    for ctx in readable:
+        console.print(Panel(f"Fixing: {ctx.name}", style="blue"))
+
+        fixes = _dedupe_fixes(fixes_by_test.get(ctx.name, []))
+        if not fixes:
+            console.print("[yellow]No fixes generated[/yellow]")
+            continue
+
+        # All batched candidates were generated from pre-round source, so a
+        # candidate touching a file an accepted fix already rewrote would
+        # silently revert that fix; drop those instead of applying them
+        fresh = [f for f in fixes if f.file not in applied_files]
+        if len(fresh) < len(fixes):
+            console.print(
+                f"[yellow]Dropped {len(fixes) - len(fresh)} candidate(s) "
+                "targeting a file already fixed this round[/yellow]"
+            )
+        if not fresh:
+            console.print(f"[red]Could not fix {ctx.name}[/red]")
+            continue
+        fixes = fresh
+
+        console.print(f"[green]Generated {len(fixes)} fix(es)[/green]")
+        fixed, _, _ = _test_candidates(
+            project_path,
+            framework,
+            ctx.name,
+            fixes,
+            dry_run,
+            max_context_lines=max_context_lines,
+            applied_files=applied_files,
+        )
+        if fixed:
+            fixed_count += 1
+        else:
+            console.print(f"[red]Could not fix {ctx.name}[/red]")
+
+    return fixed_count
+
 
 @click.command()
 @click.argument("path", type=click.Path(exists=True), default=".")
@@ -32,8 +237,33 @@ err_console = Console(file=sys.stderr)
 )
 @click.option("--dry-run", is_flag=True, help="Show fixes without applying")
 @click.option("--max-attempts", default=3, type=int, help="Max fix attempts per test")
+@click.option(
+    "--batch-tests",
+    is_flag=True,
+    help="Batch all failing tests into one prompt per agent",
+)
+@click.option(
+    "--max-context-lines",
+    default=200,
+    type=int,
+    help="Lines of test output kept around each failure",
+)
+@click.option(
+    "--full-context",
+    is_flag=True,
+    help="Send full test files and logs to agents instead of failing regions",
+)
 @click.version_option()
-def main(path: str, agents: int, framework: str, dry_run: bool, max_attempts: int):
+def main(
+    path: str,
+    agents: int,
+    framework: str,
+    dry_run: bool,
+    max_attempts: int,
+    batch_tests: bool,
+    max_context_lines: int,
+    full_context: bool,
+):
     """Parallel AI agents race to fix your failing tests.
 
     Examples:
@@ -61,7 +291,7 @@ def main(path: str, agents: int, framework: str, dry_run: bool, max_attempts: in
         transient=True,
     ) as progress:
         progress.add_task("Running tests...", total=None)
-        result = run_tests(project_path, framework)
+        result = run_tests(project_path, framework, max_context_lines)
 
     if result.passed:
         console.print("[green]All tests passing![/green]")
@@ -79,91 +309,133 @@ def main(path: str, agents: int, framework: str, dry_run: bool, max_attempts: in
         console.print(f"  [dim]- {test}[/dim]")
     console.print()
 
-    # Try to fix each failing test
-    fixed_count = 0
-    for test_name in result.failed_tests:
-        console.print(Panel(f"Fixing: {test_name}", style="blue"))
+    if batch_tests:
+        fixed_count = _fix_batched(
+            project_path,
+            framework,
+            result,
+            agents,
+            dry_run,
+            max_context_lines,
+            full_context,
+        )
+    else:
+        # Try to fix each failing test. Context reads for upcoming tests are
+        # prefetched in background threads so their disk I/O overlaps the
+        # current test's (network-bound) agent round.
+        fixed_count = 0
+        context_futures = {
+            test_name: _PREFETCH_POOL.submit(
+                get_test_context, project_path, test_name, framework, full_context
+            )
+            for test_name in result.failed_tests
+        }
+        applied_files: set[str] = set()
+        for test_name in result.failed_tests:
+            console.print(Panel(f"Fixing: {test_name}", style="blue"))
 
-        # Get test context
-        test_ctx = get_test_context(project_path, test_name, framework)
-        if not test_ctx.source:
-            console.print(f"[yellow]Could not read test source for {test_name}[/yellow]")
-            continue
+            test_ctx = context_futures[test_name].result()
+            if test_ctx.file in applied_files:
+                # An earlier accepted fix rewrote this file after the
+                # prefetch ran; re-read so agents see the fixed source
+                test_ctx = get_test_context(
+                    project_path, test_name, framework, full_context
+                )
+            # Only the failure's own traceback section unless --full-context
+            current_output = result.output
+            if not full_context:
+                current_output = result.per_test_output.get(test_name, result.output)
+            feedback = ""
+            if not test_ctx.source:
+                console.print(
+                    f"[yellow]Could not read test source for {test_name}[/yellow]"
+                )
+                continue
 
-        for attempt in range(max_attempts):
-            console.print(f"[dim]Attempt {attempt + 1}/{max_attempts}[/dim]")
+            originals: dict[str, str] = {}
+            for attempt in range(max_attempts):
+                console.print(f"[dim]Attempt {attempt + 1}/{max_attempts}[/dim]")
 
-            # Run agents in parallel
-            with Progress(
-                SpinnerColumn(),
-                TextColumn("[progress.description]{task.description}"),
-                console=err_console,
-                transient=True,
-            ) as progress:
-                progress.add_task(f"Running {agents} agents...", total=None)
-                fixes = run_parallel_agents(
+                # Progressive escalation: one temperature-0 agent first, the
+                # higher-temperature batch only if its fix doesn't stick.
+                # Agents see the latest failure output plus a diff of the
+                # last failed fix, not the stale pre-fix error.
+                batches = iter_fix_batches(
                     test_name,
                     test_ctx.file,
                     test_ctx.source,
-                    result.output,
+                    current_output,
                     agents,
+                    feedback=feedback,
                 )
-
-            if not fixes:
-                console.print("[yellow]No fixes generated[/yellow]")
-                continue
-
-            console.print(f"[green]Generated {len(fixes)} fix(es)[/green]")
-
-            # Try each fix
-            original_content = Path(test_ctx.file).read_text() if Path(test_ctx.file).exists() else ""
-
-            for fix in fixes:
-                if dry_run:
-                    # Show fix without applying
-                    table = Table(title=f"Agent {fix.agent_id}")
-                    table.add_column("Field", style="cyan")
-                    table.add_column("Value")
-                    table.add_row("File", fix.file)
-                    table.add_row("Explanation", fix.explanation)
-                    console.print(table)
-                    console.print("[dim]Content preview (first 500 chars):[/dim]")
-                    console.print(fix.new_content[:500])
-                    console.print()
-                    continue
-
-                # Apply fix and test
-                if apply_fix(project_path, fix.file, fix.new_content):
+                seen: set[bytes] = set()
+                fixed = False
+                generated = 0
+                while True:
                     with Progress(
                         SpinnerColumn(),
                         TextColumn("[progress.description]{task.description}"),
                         console=err_console,
                         transient=True,
                     ) as progress:
-                        progress.add_task("Testing fix...", total=None)
-                        new_result = run_tests(project_path, framework)
+                        progress.add_task("Running agents...", total=None)
+                        batch = next(batches, None)
+                    if batch is None:
+                        break
 
-                    if new_result.passed or test_name not in new_result.failed_tests:
-                        console.print(
-                            f"[green]Agent {fix.agent_id} fixed the test![/green]"
-                        )
-                        console.print(f"[dim]{fix.explanation}[/dim]")
-                        fixed_count += 1
+                    fixes = _dedupe_fixes(batch, seen)
+                    if not fixes:
+                        continue
+                    generated += len(fixes)
+                    console.print(f"[green]Generated {len(fixes)} fix(es)[/green]")
+
+                    fixed, latest_output, last_failed_fix = _test_candidates(
+                        project_path,
+                        framework,
+                        test_name,
+                        fixes,
+                        dry_run,
+                        originals,
+                        max_context_lines,
+                        applied_files,
+                    )
+                    if fixed:
                         break
-                    else:
-                        # Revert and try next fix
-                        apply_fix(project_path, fix.file, original_content)
-            else:
-                # No fix worked for this attempt
-                continue
+                    if latest_output:
+                        current_output = latest_output
+                    if last_failed_fix is not None:
+                        feedback = _fix_feedback(
+                            last_failed_fix,
+                            originals.get(last_failed_fix.file, ""),
+                        )
 
-            # Fix succeeded, move to next test
-            break
-        else:
-            console.print(f"[red]Could not fix {test_name}[/red]")
+                if fixed:
+                    fixed_count += 1
+                    break
+                if not generated:
+                    console.print("[yellow]No fixes generated[/yellow]")
+            else:
+                console.print(f"[red]Could not fix {test_name}[/red]")
 
     console.print()
     if fixed_count > 0:
+        # Candidate verification only ran the targeted tests; validate the
+        # fixes against the full suite before declaring victory
+        if not dry_run:
+            with Progress(
+                SpinnerColumn(),
+                TextColumn("[progress.description]{task.description}"),
+                console=err_console,
+                transient=True,
+            ) as progress:
+                progress.add_task("Running full suite...", total=None)
+                final_result = run_tests(project_path, framework, max_context_lines)
+            if not final_result.passed:
+                console.print(
+                    "[yellow]Full suite still failing after fixes:[/yellow]"
+                )
+                for test in final_result.failed_tests:
+                    console.print(f"  [dim]- {test}[/dim]")
         console.print(
             f"[green]Fixed {fixed_count}/{len(result.failed_tests)} test(s)[/green]"
         )
@@ -0,0 +1,49 @@
+"""On-disk cache for LLM responses keyed by request hash."""
+
+import os
+import json
+import hashlib
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from diskcache import Cache
+
+_CACHE_DIR = Path(
+    os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+) / "multi-agent-fix"
+
+_cache: Cache | None = None
+
+# Cached entries expire after a day; stale fixes are worse than slow ones.
+_EXPIRE_SECONDS = 3600 * 24
+
+
+def _get_cache() -> Cache:
+    global _cache
+    if _cache is None:
+        _cache = Cache(str(_CACHE_DIR))
+    return _cache
+
+
+def request_key(provider: str, model: str, temperature: float, prompt: str) -> str:
+    """Deterministic key for an LLM request."""
+    fields = {"p": provider, "m": model, "t": temperature, "pr": prompt}
+    if orjson is not None:
+        payload = orjson.dumps(fields, option=orjson.OPT_SORT_KEYS)
+    else:
+        payload = json.dumps(fields, sort_keys=True).encode()
+    return hashlib.sha256(payload).hexdigest()
+
+
+def get(key: str) -> str | None:
+    """Return the cached response for key, or None on miss."""
+    return _get_cache().get(key)
+
+
+def set(key: str, value: str) -> None:
+    """Store a response under key."""
+    _get_cache().set(key, value, expire=_EXPIRE_SECONDS)
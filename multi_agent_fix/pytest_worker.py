@@ -0,0 +1,86 @@
+"""Persistent in-process pytest worker.
+
+Started once per project by runner.run_tests. Reads one test node ID per
+line on stdin and writes one JSON result line ({"returncode", "output"})
+per run on stdout. pytest and its dependency tree are imported once here;
+each run happens in a fork of this process, so interpreter startup leaves
+the per-candidate hot path while the project's modules (including files a
+fix just rewrote) are still imported fresh every time.
+"""
+
+import io
+import os
+import sys
+import json
+import signal
+import contextlib
+
+import pytest
+
+
+class _Timeout(Exception):
+    pass
+
+
+def _on_alarm(signum, frame):
+    raise _Timeout
+
+
+def _run_in_fork(args: list[str], timeout: int) -> dict:
+    """Run pytest.main(args) in a forked child and collect its result.
+
+    The child runs arbitrary candidate-fix code that may loop forever, so
+    the pipe read is bounded by SIGALRM; on expiry the child is killed and
+    a timeout result is reported instead.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # Child: run pytest with output captured, report through the pipe
+        os.close(read_fd)
+        buf = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(buf), contextlib.redirect_stderr(buf):
+                code = int(pytest.main(args))
+        except BaseException:
+            code = 3
+        payload = json.dumps({"returncode": code, "output": buf.getvalue()})
+        with os.fdopen(write_fd, "w") as pipe:
+            pipe.write(payload)
+        os._exit(0)
+
+    os.close(write_fd)
+    signal.signal(signal.SIGALRM, _on_alarm)
+    signal.alarm(timeout)
+    try:
+        with os.fdopen(read_fd) as pipe:
+            payload = pipe.read()
+    except _Timeout:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        return {"returncode": 124, "output": "Test timeout"}
+    finally:
+        signal.alarm(0)
+    os.waitpid(pid, 0)
+    try:
+        return json.loads(payload)
+    except json.JSONDecodeError:
+        return {"returncode": 3, "output": payload}
+
+
+def main() -> None:
+    timeout = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    for line in sys.stdin:
+        nodeid = line.strip()
+        if not nodeid:
+            continue
+        result = _run_in_fork(
+            ["-x", "--tb=short", "-q", "-p", "no:cacheprovider", nodeid],
+            timeout,
+        )
+        sys.stdout.write(json.dumps(result) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
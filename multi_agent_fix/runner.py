@@ -1,8 +1,18 @@
 """Test runner and failure detection."""
 
+import ast
+import os
+import re
+import sys
+import json
+import atexit
+import threading
 import subprocess
-from dataclasses import dataclass
+from collections import deque
+from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
+from typing import Callable
 
 
 @dataclass
@@ -12,6 +22,9 @@ class TestResult:
     passed: bool
     output: str
     failed_tests: list[str]
+    # Failure section per failed test (pytest only), so agents can be
+    # prompted with just the relevant traceback instead of the whole log
+    per_test_output: dict[str, str] = field(default_factory=dict)
 
 
 @dataclass
@@ -37,8 +50,103 @@ def detect_test_framework(path: Path) -> str:
     return "pytest"  # default
 
 
-def run_tests(path: Path, framework: str) -> TestResult:
-    """Run tests and return results."""
+# Wall-clock budget for one test-suite run before the process is killed
+_SUITE_TIMEOUT_SECONDS = 300
+
+# One persistent pytest worker per project path. The worker imports pytest
+# once and forks per run, so targeted re-runs skip interpreter startup.
+_WORKERS: dict[str, subprocess.Popen] = {}
+
+
+def _get_pytest_worker(path: Path) -> subprocess.Popen:
+    key = str(path)
+    proc = _WORKERS.get(key)
+    if proc is None or proc.poll() is not None:
+        # The worker runs with the target project as cwd, so make sure our
+        # own package stays importable even when not installed there
+        env = dict(os.environ)
+        package_root = str(Path(__file__).resolve().parent.parent)
+        env["PYTHONPATH"] = os.pathsep.join(
+            filter(None, [package_root, env.get("PYTHONPATH")])
+        )
+        proc = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "multi_agent_fix.pytest_worker",
+                str(_SUITE_TIMEOUT_SECONDS),
+            ],
+            cwd=path,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+            env=env,
+        )
+        _WORKERS[key] = proc
+    return proc
+
+
+def _shutdown_workers() -> None:
+    for proc in _WORKERS.values():
+        if proc.poll() is None:
+            proc.stdin.close()
+            proc.terminate()
+
+
+atexit.register(_shutdown_workers)
+
+
+def _run_pytest_worker(path: Path, only: list[str]) -> TestResult | None:
+    """Run the given node IDs on the persistent worker; None if it fails."""
+    try:
+        worker = _get_pytest_worker(path)
+        results = []
+        for nodeid in only:
+            worker.stdin.write(nodeid + "\n")
+            worker.stdin.flush()
+            line = worker.stdout.readline()
+            if not line:
+                raise RuntimeError("pytest worker exited")
+            results.append(json.loads(line))
+    except Exception:
+        return None
+
+    # The worker kills runs that exceed the suite budget (candidate fixes
+    # can loop forever); report those the same way the streaming path does
+    if any(r["returncode"] == 124 for r in results):
+        return TestResult(passed=False, output="Test timeout", failed_tests=[])
+
+    output = "".join(r["output"] for r in results)
+    return TestResult(
+        passed=all(r["returncode"] == 0 for r in results),
+        output=output,
+        failed_tests=parse_failed_tests(output, "pytest"),
+    )
+
+
+def run_tests(
+    path: Path,
+    framework: str,
+    max_context_lines: int = 200,
+    only: list[str] | None = None,
+) -> TestResult:
+    """Run tests and return results.
+
+    Output is streamed line by line instead of buffered whole: failures are
+    parsed on the fly and only a window of ``max_context_lines`` lines around
+    each failure is retained. TestResult.output feeds agent prompts, so its
+    size is token cost.
+
+    ``only`` restricts the run to the given test node IDs (pytest only), so
+    candidate-fix verification costs one test instead of the whole suite.
+    """
+    if only and framework == "pytest":
+        # Prefer the persistent worker; fall back to a subprocess if it dies
+        result = _run_pytest_worker(path, only)
+        if result is not None:
+            return result
+
     commands = {
         "pytest": ["python", "-m", "pytest", "-v", "--tb=short"],
         "npm": ["npm", "test"],
@@ -46,63 +154,187 @@ def run_tests(path: Path, framework: str) -> TestResult:
         "go": ["go", "test", "./..."],
     }
 
-    cmd = commands.get(framework, commands["pytest"])
+    if only and framework == "pytest":
+        cmd = [
+            "python",
+            "-m",
+            "pytest",
+            "-x",
+            "--tb=short",
+            "-q",
+            "-p",
+            "no:cacheprovider",
+            *only,
+        ]
+    else:
+        cmd = commands.get(framework, commands["pytest"])
+    pattern, extract = _FRAMEWORK_PARSERS.get(
+        framework, _FRAMEWORK_PARSERS["pytest"]
+    )
 
     try:
-        result = subprocess.run(
+        proc = subprocess.Popen(
             cmd,
             cwd=path,
-            capture_output=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
             text=True,
-            timeout=300,
+            bufsize=1,
+        )
+
+        # The read loop below blocks on the pipe, so the suite deadline has
+        # to come from outside: a timer kills the process, which closes the
+        # pipe and unblocks us
+        timed_out = threading.Event()
+
+        def _kill_on_timeout() -> None:
+            timed_out.set()
+            proc.kill()
+
+        timer = threading.Timer(_SUITE_TIMEOUT_SECONDS, _kill_on_timeout)
+        timer.daemon = True
+        timer.start()
+
+        failed_tests: list[str] = []
+        before: deque[str] = deque(maxlen=max_context_lines)
+        captured: list[str] = []
+        after_remaining = 0
+        # pytest failure sections, split on the "____ test_name ____" banners
+        sections: dict[str, list[str]] = {}
+        current_section: list[str] | None = None
+
+        assert proc.stdout is not None
+        for line in proc.stdout:
+            banner = _SECTION_BANNER_RE.match(line)
+            if banner:
+                current_section = sections.setdefault(banner.group(1), [])
+            elif line.startswith("="):
+                current_section = None
+            if current_section is not None:
+                current_section.append(line)
+
+            match = pattern.search(line)
+            if match:
+                failed_tests.append(extract(match))
+                # Flush the lines leading up to this failure, then keep
+                # capturing the details that follow it
+                captured.extend(before)
+                before.clear()
+                captured.append(line)
+                after_remaining = max_context_lines
+            elif after_remaining > 0:
+                captured.append(line)
+                after_remaining -= 1
+            else:
+                before.append(line)
+
+        returncode = proc.wait()
+        timer.cancel()
+        if timed_out.is_set():
+            return TestResult(passed=False, output="Test timeout", failed_tests=[])
+
+        per_test_output: dict[str, str] = {}
+        if framework == "pytest":
+            for name in failed_tests:
+                # Nodeid tests/test_x.py::TestY::test_z has the banner
+                # title TestY.test_z
+                title = name.split("::", 1)[-1].replace("::", ".")
+                if title in sections:
+                    per_test_output[name] = "".join(sections[title])
+
+        # With no failures, fall back to the tail of the log
+        output = "".join(captured) if captured else "".join(before)
+        return TestResult(
+            passed=returncode == 0,
+            output=output,
+            failed_tests=failed_tests,
+            per_test_output=per_test_output,
         )
-        output = result.stdout + result.stderr
-        passed = result.returncode == 0
-        failed_tests = parse_failed_tests(output, framework)
-        return TestResult(passed=passed, output=output, failed_tests=failed_tests)
-    except subprocess.TimeoutExpired:
-        return TestResult(passed=False, output="Test timeout", failed_tests=[])
     except Exception as e:
         return TestResult(passed=False, output=str(e), failed_tests=[])
 
 
+# Precompiled failure-line patterns. A single finditer pass over the whole
+# output buffer avoids materializing a per-line list of a potentially
+# multi-megabyte test log.
+_PYTEST_FAIL_RE = re.compile(r"^FAILED\s+(\S+)", re.MULTILINE)
+_NPM_FAIL_RE = re.compile(r"(?:✕|FAIL)\s+(.+)$", re.MULTILINE)
+_CARGO_FAIL_RE = re.compile(r"^(.*(?:FAILED|test result:).*)$", re.MULTILINE)
+_GO_FAIL_RE = re.compile(r"^--- FAIL:\s+(\S+)", re.MULTILINE)
+
+# pytest failure-section header, e.g. "________ TestFoo.test_bar ________"
+_SECTION_BANNER_RE = re.compile(r"^_{5,}\s+(.+?)\s+_{5,}\s*$")
+
+# Pattern and match-extractor per framework, selected once per parse rather
+# than re-dispatching an if/elif chain on every line
+_FRAMEWORK_PARSERS: dict[str, tuple[re.Pattern, Callable[[re.Match], str]]] = {
+    "pytest": (_PYTEST_FAIL_RE, lambda m: m.group(1)),
+    "npm": (_NPM_FAIL_RE, lambda m: m.group(1).strip()),
+    "cargo": (_CARGO_FAIL_RE, lambda m: m.group(1).strip()),
+    "go": (_GO_FAIL_RE, lambda m: m.group(1)),
+}
+
+
 def parse_failed_tests(output: str, framework: str) -> list[str]:
     """Parse test output to find failed test names."""
-    failed = []
+    parser = _FRAMEWORK_PARSERS.get(framework)
+    if parser is None:
+        return []
+    pattern, extract = parser
+    return [extract(m) for m in pattern.finditer(output)]
 
-    if framework == "pytest":
-        for line in output.split("\n"):
-            if "FAILED" in line and "::" in line:
-                # Format: FAILED tests/test_foo.py::test_bar
-                parts = line.split("FAILED")[1].strip()
-                if parts:
-                    failed.append(parts.split()[0])
 
-    elif framework == "npm":
-        for line in output.split("\n"):
-            if "✕" in line or "FAIL" in line:
-                failed.append(line.strip())
+@lru_cache(maxsize=256)
+def _read_source(path_str: str) -> str:
+    """Read a test file once; repeated context lookups hit the cache."""
+    return Path(path_str).read_text()
 
-    elif framework == "cargo":
-        for line in output.split("\n"):
-            if "FAILED" in line or "test result:" in line:
-                failed.append(line.strip())
 
-    elif framework == "go":
-        for line in output.split("\n"):
-            if "--- FAIL:" in line:
-                failed.append(line.replace("--- FAIL:", "").strip())
+def slice_test_function(source: str, func_name: str) -> str:
+    """Return just the named test function plus module imports.
+
+    Prompt length is latency and cost, so only the failing function (and
+    the imports it may reference) is worth sending. Falls back to the full
+    source when the function can't be located.
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return source
+
+    lines = source.splitlines()
+    pieces = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            pieces.append("\n".join(lines[node.lineno - 1 : node.end_lineno]))
+
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+            and node.name == func_name
+        ):
+            start = min(
+                [node.lineno] + [d.lineno for d in node.decorator_list]
+            )
+            pieces.append("\n".join(lines[start - 1 : node.end_lineno]))
+            return "\n\n".join(pieces)
 
-    return failed
+    return source
 
 
-def get_test_context(path: Path, test_name: str, framework: str) -> FailedTest:
+def get_test_context(
+    path: Path, test_name: str, framework: str, full_context: bool = False
+) -> FailedTest:
     """Get the source code context for a failed test."""
     if framework == "pytest" and "::" in test_name:
         file_part = test_name.split("::")[0]
         test_file = path / file_part
         if test_file.exists():
-            source = test_file.read_text()
+            source = _read_source(str(test_file))
+            if not full_context:
+                # tests/test_x.py::TestY::test_z[case] -> test_z
+                func_name = test_name.split("::")[-1].split("[")[0]
+                source = slice_test_function(source, func_name)
             return FailedTest(
                 name=test_name,
                 file=str(test_file),
@@ -120,6 +352,8 @@ def apply_fix(path: Path, file: str, new_content: str) -> bool:
         if not file_path.is_absolute():
             file_path = path / file
         file_path.write_text(new_content)
+        # The file on disk changed; cached source reads are now stale
+        _read_source.cache_clear()
         return True
     except Exception:
         return False
@@ -0,0 +1,32 @@
+"""Tests for agent response parsing."""
+
+from multi_agent_fix.agent import _extract_json_object, _extract_json_array
+
+
+def test_extract_json_object():
+    """Extract a JSON object surrounded by prose."""
+    response = 'Here is the fix:\n```json\n{"file": "a.py", "content": "x = 1"}\n```\nDone.'
+    data = _extract_json_object(response)
+    assert data == {"file": "a.py", "content": "x = 1"}
+
+
+def test_extract_json_object_with_braces_in_strings():
+    """Braces inside string values don't truncate the object."""
+    response = '{"file": "a.py", "content": "d = {\\"k\\": 1}"} trailing {garbage'
+    data = _extract_json_object(response)
+    assert data is not None
+    assert data["content"] == 'd = {"k": 1}'
+
+
+def test_extract_json_object_malformed():
+    """Malformed responses return None instead of raising."""
+    assert _extract_json_object("no json here") is None
+    assert _extract_json_object('{"unterminated": ') is None
+
+
+def test_extract_json_array():
+    """Extract a JSON array of fixes."""
+    response = '[{"test": "t1", "content": "a"}, {"test": "t2", "content": "b"}]'
+    entries = _extract_json_array(response)
+    assert len(entries) == 2
+    assert entries[0]["test"] == "t1"
@@ -43,3 +43,48 @@ def test_detect_npm():
         path = Path(tmpdir)
         (path / "package.json").touch()
         assert detect_test_framework(path) == "npm"
+
+
+def test_slice_test_function():
+    """Slice out one test function plus imports."""
+    from multi_agent_fix.runner import slice_test_function
+
+    source = """import os
+from pathlib import Path
+
+
+def test_one():
+    assert os.sep
+
+
+def test_two():
+    assert Path(".").exists()
+"""
+    sliced = slice_test_function(source, "test_two")
+    assert "def test_two" in sliced
+    assert "def test_one" not in sliced
+    assert "import os" in sliced
+
+
+def test_slice_test_function_missing_falls_back():
+    """Unknown function names return the full source."""
+    from multi_agent_fix.runner import slice_test_function
+
+    source = "def test_one():\n    assert True\n"
+    assert slice_test_function(source, "test_missing") == source
+
+
+def test_apply_fix_invalidates_source_cache():
+    """Contexts read after a fix see the new file content, not the cache."""
+    from multi_agent_fix.runner import apply_fix, get_test_context
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir)
+        test_file = path / "test_y.py"
+        test_file.write_text("def test_a():\n    assert False\n")
+        ctx = get_test_context(path, "test_y.py::test_a", "pytest")
+        assert "assert False" in ctx.source
+
+        apply_fix(path, str(test_file), "def test_a():\n    assert True\n")
+        ctx = get_test_context(path, "test_y.py::test_a", "pytest")
+        assert "assert True" in ctx.source